@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+pylidar_tls_canopy
+
+Code for batch processing the scans of a RISCAN project
+"""
+
+import os
+import sys
+import time
+import functools
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from . import riegl_io
+
+
+def find_scan_positions(riscan_project):
+    """
+    Find all scan positions in a RISCAN project.
+
+    Args:
+        riscan_project: Path to RISCAN project directory (.RiSCAN folder)
+
+    Returns:
+        List of scan position directories
+    """
+    project_path = Path(riscan_project)
+    scans_dir = project_path / "SCANS"
+
+    if not scans_dir.exists():
+        raise FileNotFoundError(f"SCANS directory not found in {riscan_project}")
+
+    # Find all ScanPos directories
+    scan_positions = sorted([d for d in scans_dir.iterdir()
+                            if d.is_dir() and d.name.startswith("ScanPos")])
+
+    return scan_positions
+
+
+@functools.lru_cache(maxsize=None)
+def list_directory(path):
+    """
+    List the entry names of a directory with a single os.scandir pass.
+    Results are cached so directories shared by all scan positions are
+    only read once.
+
+    Args:
+        path: Directory path
+
+    Returns:
+        Frozen set of entry names (empty if the directory does not exist)
+    """
+    try:
+        with os.scandir(path) as it:
+            return frozenset(e.name for e in it)
+    except (FileNotFoundError, NotADirectoryError):
+        return frozenset()
+
+
+def discover_scan_files(riscan_project, get_scan_files):
+    """
+    Get the scan files for all scan positions in a RISCAN project.
+
+    Args:
+        riscan_project: Path to RISCAN project directory (.RiSCAN folder)
+        get_scan_files: Function taking a scan position directory and the
+            project path, returning a scan file dictionary or None
+
+    Returns:
+        List of scan file dictionaries and list of skipped scan position names
+    """
+    project_path = Path(riscan_project)
+    scan_files = []
+    skipped = []
+    for scan_pos in find_scan_positions(riscan_project):
+        files = get_scan_files(scan_pos, project_path)
+        if files:
+            scan_files.append(files)
+        else:
+            skipped.append(scan_pos.name)
+
+    return scan_files, skipped
+
+
+def read_sensor_positions(transform_files):
+    """
+    Read the sensor position (translation row) of each transform file once.
+
+    Args:
+        transform_files: List of transform file paths
+
+    Returns:
+        Dictionary of (x, y, z) sensor positions keyed by transform file path
+    """
+    sensor_positions = {}
+    for fn in transform_files:
+        if fn not in sensor_positions:
+            transform_matrix = riegl_io.read_transform_file(fn)
+            sensor_positions[fn] = tuple(float(v) for v in transform_matrix[3, :3])
+
+    return sensor_positions
+
+
+# Profiling results added to the worker results by profile_worker
+PROFILE_KEYS = ['elapsed_s', 'peak_bytes', 'max_rss_delta_bytes']
+
+
+def get_max_rss():
+    """
+    Get the peak resident set size of this process.
+
+    Returns:
+        Peak resident set size in bytes, or None if the resource module
+        is not available (e.g., on Windows)
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    if sys.platform == 'darwin':
+        return max_rss
+    return max_rss * 1024
+
+
+def profile_worker(worker, *args, **kwargs):
+    """
+    Run a worker function and add its wall time and peak memory to the result.
+
+    Args:
+        worker: Function returning a result dictionary
+        *args, **kwargs: Arguments passed to the worker
+
+    Returns:
+        Worker result dictionary with elapsed_s (wall time in seconds),
+        peak_bytes (peak memory traced by tracemalloc) and
+        max_rss_delta_bytes (increase in the peak resident set size of the
+        process while the worker ran, if the resource module is available)
+    """
+    max_rss = get_max_rss()
+    t0 = time.perf_counter()
+    tracemalloc.start()
+    try:
+        result = worker(*args, **kwargs)
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    result['elapsed_s'] = time.perf_counter() - t0
+    result['peak_bytes'] = peak_bytes
+    if max_rss is not None:
+        result['max_rss_delta_bytes'] = get_max_rss() - max_rss
+    return result
+
+
+def run_scans(worker, scan_files, jobs=1):
+    """
+    Run a worker function on each scan, in a process pool if jobs > 1.
+
+    Args:
+        worker: Picklable function taking a scan_info dictionary
+        scan_files: List of scan_info dictionaries
+        jobs: Number of worker processes
+
+    Yields:
+        Worker results in order of completion
+    """
+    if jobs == 1:
+        for scan_info in scan_files:
+            yield worker(scan_info)
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(worker, scan_info) for scan_info in scan_files]
+            for future in as_completed(futures):
+                yield future.result()
@@ -201,30 +201,47 @@ class Jupp2009:
         
         self.pgap_theta_z = 1 - cover_theta_z 
 
-    def calcLinearPlantProfiles(self, calc_mla=False):
+    def get_pgap_derivatives(self):
         """
-        Calculate the linear model PAI (see Jupp et al., 2009)
+        Get the functions of the Pgap profiles that are shared by the
+        linear, hinge and solid angle weighted PAI calculations
         """
         zenith_bin_r = np.radians(self.zenith_bin)
-        kthetal = np.full(self.pgap_theta_z.shape, np.log(1e-5), dtype=float)
-        np.log(self.pgap_theta_z, out=kthetal, where=self.pgap_theta_z>0)
-        xtheta = np.abs(2 * np.tan(zenith_bin_r) / np.pi)
+        
+        pai_lim = np.log(1e-5)
+        log_pgap = np.full(self.pgap_theta_z.shape, pai_lim, dtype=float)
+        np.log(self.pgap_theta_z, out=log_pgap, where=self.pgap_theta_z > 0)
+
+        prep = {'zenith_bin_r': zenith_bin_r, 'log_pgap': log_pgap}
+        prep['xtheta'] = np.abs(2 * np.tan(zenith_bin_r) / np.pi)
+        prep['solid_angle'] = 2 * np.pi * np.sin(zenith_bin_r) * self.zres_r
+
+        return prep
+
+    def calcLinearPlantProfiles(self, calc_mla=False, prep=None):
+        """
+        Calculate the linear model PAI (see Jupp et al., 2009)
+        """
+        if prep is None:
+            prep = self.get_pgap_derivatives()
+        xtheta = prep['xtheta']
         paiv = np.zeros(self.pgap_theta_z.shape[1], dtype=np.float32)
         paih = np.zeros(self.pgap_theta_z.shape[1], dtype=np.float32)
-        for i,h in enumerate(self.height_bin):
+        
+        # -log(Pgap) is finite, so all heights share the same design matrix
+        # and are solved together
+        if xtheta.shape[0] > 2:
             a = np.vstack([xtheta, np.ones(xtheta.shape[0])]).T
-            y = -kthetal[:,i]
-            valid = ~np.isnan(y)
-            if np.count_nonzero(valid) > 2:
-                result,resid,rank,s = np.linalg.lstsq(a[valid,:], y[valid], rcond=None)
-                paiv[i] = result[0]
-                paih[i] = result[1]
-                if result[0] < 0:
-                    paih[i] = np.nanmean(y)
-                    paiv[i] = 0.0
-                if result[1] < 0:
-                    paiv[i] = np.mean(y[valid] / xtheta[valid])
-                    paih[i] = 0.0
+            y = -prep['log_pgap']
+            result,resid,rank,s = np.linalg.lstsq(a, y, rcond=None)
+            paiv[:] = result[0]
+            paih[:] = result[1]
+            idx = result[0] < 0
+            paih[idx] = np.mean(y[:,idx], axis=0)
+            paiv[idx] = 0.0
+            idx = result[1] < 0
+            paiv[idx] = np.mean(y[:,idx] / xtheta[:,np.newaxis], axis=0)
+            paih[idx] = 0.0
 
         pai = paiv + paih
         if calc_mla:
@@ -233,42 +250,33 @@ class Jupp2009:
         else:
             return pai        
 
-    def calcHingePlantProfiles(self):
+    def calcHingePlantProfiles(self, prep=None):
         """
         Calculate the hinge angle PAI (see Jupp et al., 2009)
         """
-        zenith_bin_r = np.radians(self.zenith_bin)
-        hingeindex = np.argmin(np.abs(zenith_bin_r - np.arctan(np.pi / 2)))
+        if prep is None:
+            prep = self.get_pgap_derivatives()
+        hingeindex = np.argmin(np.abs(prep['zenith_bin_r'] - np.arctan(np.pi / 2)))
         
-        pai_lim = np.log(1e-5)
-        tmp = np.full(self.pgap_theta_z.shape[1], pai_lim)
-        np.log(self.pgap_theta_z[hingeindex,:], out=tmp, 
-            where=self.pgap_theta_z[hingeindex,:] > 0)
-        
-        pai = -1.1 * tmp
+        pai = -1.1 * prep['log_pgap'][hingeindex,:]
 
         return pai
 
-    def calcSolidAnglePlantProfiles(self, total_pai=None):
+    def calcSolidAnglePlantProfiles(self, total_pai=None, prep=None):
         """
         Calculate the Jupp et al. (2009) solid angle weighted PAI
         """
-        zenith_bin_r = np.radians(self.zenith_bin)
-        zenith_bin_size = zenith_bin_r[1] - zenith_bin_r[0]
-        w = 2 * np.pi * np.sin(zenith_bin_r) * zenith_bin_size
-        wn = w / np.sum(w[self.pgap_theta_z[:,-1] < 1])
-        ratio = np.zeros(self.pgap_theta_z.shape[1])
+        if prep is None:
+            prep = self.get_pgap_derivatives()
+        valid = self.pgap_theta_z[:,-1] < 1
+        w = prep['solid_angle']
+        wn = w / np.sum(w[valid])
 
-        pai_lim = np.log(1e-5)
-        for i in range(zenith_bin_r.shape[0]):
-            if (self.pgap_theta_z[i,-1] < 1):
-                num = np.full(self.pgap_theta_z.shape[1], pai_lim)
-                np.log(self.pgap_theta_z[i,:], out=num, where=self.pgap_theta_z[i,:] > 0)
-                den = np.log(self.pgap_theta_z[i,-1]) if (self.pgap_theta_z[i,-1] > 0) else pai_lim
-                ratio += wn[i] * num / den
+        log_pgap = prep['log_pgap'][valid,:]
+        ratio = np.sum(wn[valid,np.newaxis] * log_pgap / log_pgap[:,-1:], axis=0)
 
         if total_pai is None:
-            hpp_pai = self.calcHingePlantProfiles()
+            hpp_pai = self.calcHingePlantProfiles(prep=prep)
             total_pai = np.max(hpp_pai)
          
         pai = total_pai * ratio
@@ -278,27 +286,31 @@ class Jupp2009:
     def get_pavd(self, pai_z, central=True):
         """
         Get the PAVD from the vertical PAI profile
+        Multiple profiles can be stacked along the first axis
         """
         if not central:
-            pavd = np.diff(pai_z, n=1, append=0) / self.hres
+            pavd = np.diff(pai_z, n=1, append=0, axis=-1) / self.hres
         else:
-            pavd = np.gradient(pai_z, self.hres)
+            pavd = np.gradient(pai_z, self.hres, axis=-1)
         return pavd
 
     def exportPlantProfiles(self, outfile=None):
         """
         Write out the vertical plant profiles to file
         """
-        linear_pai,linear_mla = self.calcLinearPlantProfiles(calc_mla=True)
+        prep = self.get_pgap_derivatives()
+        linear_pai,linear_mla = self.calcLinearPlantProfiles(calc_mla=True, prep=prep)
         plant_profiles = {'Height': self.height_bin,
-                          'HingePAI': self.calcHingePlantProfiles(),
+                          'HingePAI': self.calcHingePlantProfiles(prep=prep),
                           'LinearPAI': linear_pai,
                           'LinearMLA': linear_mla,       
-                          'WeightedPAI': self.calcSolidAnglePlantProfiles()}
+                          'WeightedPAI': self.calcSolidAnglePlantProfiles(prep=prep)}
         
-        plant_profiles['HingePAVD'] = self.get_pavd(plant_profiles['HingePAI'])
-        plant_profiles['LinearPAVD'] = self.get_pavd(plant_profiles['LinearPAI'])
-        plant_profiles['WeightedPAVD'] = self.get_pavd(plant_profiles['WeightedPAI'])
+        pavd = self.get_pavd(np.vstack([plant_profiles['HingePAI'],
+            plant_profiles['LinearPAI'], plant_profiles['WeightedPAI']]))
+        plant_profiles['HingePAVD'] = pavd[0]
+        plant_profiles['LinearPAVD'] = pavd[1]
+        plant_profiles['WeightedPAVD'] = pavd[2]
 
         df = pd.DataFrame.from_dict(plant_profiles)
         if outfile is None:
@@ -443,17 +455,19 @@ def min_z_grid(x, y, z, r, minx, maxy, resolution, outgrid, valid):
                 valid[yi,xi] = True
 
 
-def plane_fit_hubers(x, y, z, w=None, reportfile=None):
+def plane_fit_hubers(x, y, z, w=None, reportfile=None, start_params=None):
     """
     Plane fitting (Huber's T norm with median absolute deviation scaling)
     Prior weights are set to 1 / point range
+    Optional start_params [intercept, x slope, y slope] (e.g., the plane of
+    a nearby scan position) warm start the IRLS iterations instead of OLS
     """
     if w is None:
         w = np.ones(z.shape, dtype=np.float32)
     wz = w * z
     wxy = np.vstack((w,x*w,y*w)).T
     huber_t = sm.RLM(wz, wxy, M=sm.robust.norms.HuberT())
-    huber_results = huber_t.fit()
+    huber_results = huber_t.fit(start_params=start_params)
     
     output = {}
     output['Parameters'] = huber_results.params
@@ -69,27 +69,58 @@ class VoxelModel:
         for k in names:
             self.voxelgrids[k] = np.empty(sh, dtype=np.float32)
             for i,p in enumerate(self.positions):
-                with rio.open(self.positions[p][k],'r') as src:
-                    self.voxelgrids[k][i] = src.read(z+1)
+                self.voxelgrids[k][i] = read_voxelgrid(self.positions[p][k],
+                    z=z, nodata=self.nodata)
 
-    def run_linear_model(self, min_n=3, weights=True):
+    def read_voxelgrid_slab(self, z0, nlayers, names=['pgap','zeni','vwts']):
+        """
+        Read a slab of nlayers height layers starting at layer z0
+        The slab grids have shape (nlayers,npos,ny,nx)
+        """
+        zslice = slice(z0, min(z0 + nlayers, self.nz))
+        sh = (zslice.stop - zslice.start, self.npos, self.ny, self.nx)
+        self.voxelgrids = {}
+        for k in names:
+            self.voxelgrids[k] = np.empty(sh, dtype=np.float32)
+            for i,p in enumerate(self.positions):
+                self.voxelgrids[k][:,i] = read_voxelgrid(self.positions[p][k],
+                    z=zslice, nodata=self.nodata)
+
+    def run_linear_model_slab(self, z0, nlayers, min_n=3, weights=True):
+        """
+        Run the linear model from Jupp et al. (2009) for a slab of
+        nlayers height layers starting at layer z0
+        """
+        self.read_voxelgrid_slab(z0, nlayers, names=['pgap','zeni','vwts'])
+        sh = self.voxelgrids['pgap'].shape[:1] + (self.ny, self.nx)
+        paiv = np.empty(sh, dtype=np.float32)
+        paih = np.empty(sh, dtype=np.float32)
+        nscans = np.empty(sh, dtype=np.uint8)
+        for i in range(sh[0]):
+            if weights:
+                w = self.voxelgrids['vwts'][i]
+            else:
+                w = np.ones(self.voxelgrids['vwts'][i].shape, dtype=np.float32)
+            nscans[i] = np.sum(self.voxelgrids['vwts'][i] > 0, axis=0, dtype=np.uint8)
+            paiv[i],paih[i] = run_linear_model_numba(self.voxelgrids['zeni'][i], 
+                self.voxelgrids['pgap'][i], w, null=self.nodata, min_n=min_n)
+
+        return paiv,paih,nscans
+
+    def run_linear_model(self, min_n=3, weights=True, z_chunk=1):
         """
         Run the linear model from Jupp et al. (2009) to get the
         vertical and horizontal projected area
+        The voxel grids are read in slabs of z_chunk height layers
         """
         sh = (self.nz, self.ny, self.nx)
         paiv = np.empty(sh, dtype=np.float32)
         paih = np.empty(sh, dtype=np.float32)
         nscans = np.empty(sh, dtype=np.uint8)
-        for i in range(self.nz):
-            self.read_voxelgrids(z=i, names=['pgap','zeni','vwts'])
-            if weights:
-                w = self.voxelgrids['vwts']
-            else:
-                w = np.ones(self.voxelgrids['vwts'].shape, dtype=np.float32)
-            nscans[i] = np.sum(self.voxelgrids['vwts'] > 0, axis=0, dtype=np.uint8)
-            paiv[i],paih[i] = run_linear_model_numba(self.voxelgrids['zeni'], 
-                self.voxelgrids['pgap'], w, null=self.nodata, min_n=min_n)
+        for z0 in range(0, self.nz, z_chunk):
+            z1 = min(z0 + z_chunk, self.nz)
+            paiv[z0:z1],paih[z0:z1],nscans[z0:z1] = self.run_linear_model_slab(z0, 
+                z_chunk, min_n=min_n, weights=weights)
 
         return paiv,paih,nscans        
 
@@ -102,28 +133,33 @@ class VoxelModel:
         for k in ('occl','miss','hits'):
             voxelgrids[k] = np.zeros(sh, dtype=np.float32)
             for p in self.positions:
-                with rio.open(self.positions[p][k],'r') as src:
-                    voxelgrids[k] += src.read()
+                voxelgrids[k] += read_voxelgrid(self.positions[p][k], nodata=self.nodata)
         nbeam = voxelgrids['occl'] + voxelgrids['miss'] + voxelgrids['hits']
         poccl = np.full(sh, null, dtype=np.float32)
         np.divide(voxelgrids['occl'], nbeam, out=poccl, where=nbeam>0)
         return poccl,nbeam
 
-    def get_cover_profile(self, paiv):
+    def get_cover_profile(self, paiv, out=None):
         """
         Get the vertical canopy cover profile using conditional probability
+        The profile is computed one height layer at a time from the top,
+        optionally into out (e.g., a memory mapped array)
         """
-        pgap = np.zeros_like(paiv)
-        np.exp(-paiv, out=pgap, where=paiv != self.nodata)        
-
-        cover = np.zeros_like(pgap)
-        np.subtract(1, pgap, out=cover, where=paiv != self.nodata)
-
-        cover_z = np.zeros_like(cover)
-        for i in range(cover.shape[0]-2,-1,-1):
+        if out is None:
+            cover_z = np.zeros(paiv.shape, dtype=np.float32)
+        else:
+            cover_z = out
+            cover_z[-1] = 0
+
+        cover = np.zeros(paiv.shape[1:], dtype=np.float32)
+        for i in range(paiv.shape[0]-2,-1,-1):
+            valid = paiv[i] != self.nodata
+            cover.fill(0)
+            np.exp(-paiv[i], out=cover, where=valid)
+            np.subtract(1, cover, out=cover, where=valid)
             p_o = cover_z[i+1]
-            cover_z[i] = p_o + (1 - p_o) * cover[i]
-        
+            cover_z[i] = p_o + (1 - p_o) * cover
+
         return cover_z
 
 
@@ -271,10 +307,24 @@ class VoxelGrid:
 
         return classification
 
-    def write_grids(self, prefix):
+    def write_grids(self, prefix, file_format='tif', dtype='float32'):
         """
         Write the results to file
+        file_format is 'tif' (GeoTIFF, float32 only), 'zarr' (Blosc-Zstd
+        compressed, float32 or float16) or 'npy' (uncompressed and memory
+        mapped on read, float32 or float16)
         """
+        if file_format == 'zarr':
+            self.write_grids_zarr(prefix, dtype=dtype)
+            return
+        elif file_format == 'npy':
+            self.write_grids_npy(prefix, dtype=dtype)
+            return
+        elif file_format != 'tif':
+            raise ValueError(f'{file_format} is not a recognized voxel grid format')
+        elif dtype != self.profile['dtype']:
+            raise ValueError(f'{dtype} is not supported for GeoTIFF voxel grids')
+
         self.filenames = {}
         new_shape = (self.nz, self.ny, self.nx)
         for k in self.voxelgrids:
@@ -288,6 +338,72 @@ class VoxelGrid:
                         description = f'{height:.02f}m'
                         dst.set_band_description(i+1, description)
 
+    def write_grids_zarr(self, prefix, dtype='float32', chunks=(16,64,64)):
+        """
+        Write the results to Zarr arrays with Blosc-Zstd compression
+        A float16 dtype is only applied to the bounded grids (pgap, zeni
+        and vcls) as counts and path lengths can exceed the float16 range
+        """
+        import zarr
+        from numcodecs import Blosc
+
+        compressor = Blosc(cname='zstd', clevel=3, shuffle=Blosc.BITSHUFFLE)
+        self.filenames = {}
+        new_shape = (self.nz, self.ny, self.nx)
+        for k in self.voxelgrids:
+            self.filenames[k] = f'{prefix}_{k}.zarr'
+            grid_dtype = dtype if k in ('pgap','zeni','vcls') else 'float32'
+            dst = zarr.open(self.filenames[k], mode='w', shape=new_shape,
+                chunks=chunks, dtype=grid_dtype, compressor=compressor)
+            dst[:] = self.voxelgrids[k].reshape(new_shape)
+            dst.attrs['bounds'] = list(self.bounds)
+            dst.attrs['voxelsize'] = self.voxelsize
+            dst.attrs['nodata'] = self.nodata
+
+    def write_grids_npy(self, prefix, dtype='float32'):
+        """
+        Write the results to .npy files that can be memory mapped on read
+        A float16 dtype is only applied to the bounded grids (pgap, zeni
+        and vcls) as counts and path lengths can exceed the float16 range
+        """
+        self.filenames = {}
+        new_shape = (self.nz, self.ny, self.nx)
+        for k in self.voxelgrids:
+            self.filenames[k] = f'{prefix}_{k}.npy'
+            grid_dtype = dtype if k in ('pgap','zeni','vcls') else 'float32'
+            np.save(self.filenames[k], self.voxelgrids[k].reshape(new_shape).astype(grid_dtype),
+                allow_pickle=False)
+
+
+def read_voxelgrid(filename, z=None, nodata=-9999):
+    """
+    Read a voxel grid written by VoxelGrid.write_grids as float32
+    Returns the (nz,ny,nx) grid, the (ny,nx) layer z if z is an index,
+    or the layers in z if z is a slice (with start and stop set)
+    Zarr and npy grids are only read for the requested layers
+    """
+    if filename.endswith('.zarr'):
+        import zarr
+        src = zarr.open(filename, mode='r')
+    elif filename.endswith('.npy'):
+        src = np.load(filename, mmap_mode='r')
+    else:
+        with rio.open(filename, 'r') as src:
+            if z is None:
+                return src.read()
+            elif isinstance(z, slice):
+                return src.read(list(range(z.start+1, z.stop+1)))
+            else:
+                return src.read(z+1)
+
+    data = src[:] if z is None else src[z]
+    if data.dtype == np.float16:
+        # nodata is not exactly representable as float16
+        out = data.astype(np.float32)
+        out[data == np.float16(nodata)] = nodata
+        return out
+    return np.array(data, dtype=np.float32)
+
 
 @njit
 def extract_ground_by_pulse(x, y, target_count, data, xmin, ymax, binsize, nodata=-9999):
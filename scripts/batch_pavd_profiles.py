@@ -9,35 +9,15 @@ vertical Plant Area Volume Density (PAVD) profiles using the Jupp et al. (2009)
 import os
 import sys
 import argparse
+import functools
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import numpy as np
 import pandas as pd
 from tqdm import tqdm
 
-from pylidar_tls_canopy import riegl_io, plant_profile
-
-
-def find_scan_positions(riscan_project):
-    """
-    Find all scan positions in a RISCAN project.
-
-    Args:
-        riscan_project: Path to RISCAN project directory (.RiSCAN folder)
-
-    Returns:
-        List of scan position directories
-    """
-    project_path = Path(riscan_project)
-    scans_dir = project_path / "SCANS"
-
-    if not scans_dir.exists():
-        raise FileNotFoundError(f"SCANS directory not found in {riscan_project}")
-
-    # Find all ScanPos directories
-    scan_positions = sorted([d for d in scans_dir.iterdir()
-                            if d.is_dir() and d.name.startswith("ScanPos")])
-
-    return scan_positions
+from pylidar_tls_canopy import riegl_io, plant_profile, batch
 
 
 def get_scan_files(scan_pos_dir, project_path):
@@ -55,55 +35,199 @@ def get_scan_files(scan_pos_dir, project_path):
 
     # Find RXP file in SCANS/ScanPosXXX/SINGLESCANS/
     singlescans_dir = scan_pos_dir / "SINGLESCANS"
-    if not singlescans_dir.exists():
+    try:
+        with os.scandir(singlescans_dir) as it:
+            entries = sorted(it, key=lambda e: e.name)
+    except FileNotFoundError:
         return None
 
     rxp_file = None
     scan_name = None
 
     # First, check for subdirectories (standard RISCAN structure)
-    singlescan_dirs = [d for d in singlescans_dir.iterdir() if d.is_dir()]
+    singlescan_dirs = [e for e in entries if e.is_dir()]
     if singlescan_dirs:
         singlescan_dir = singlescan_dirs[0]
         scan_name = singlescan_dir.name
-        potential_rxp = singlescan_dir / f"{scan_name}.rxp"
-        if potential_rxp.exists():
-            rxp_file = potential_rxp
+        if f"{scan_name}.rxp" in batch.list_directory(singlescan_dir.path):
+            rxp_file = Path(singlescan_dir.path) / f"{scan_name}.rxp"
 
     # If not found in subdirectory, check for RXP files directly in SINGLESCANS
     if rxp_file is None:
-        rxp_files = [f for f in singlescans_dir.glob("*.rxp")
-                     if not f.name.endswith('.residual.rxp')]
+        rxp_files = [e for e in entries if e.name.endswith('.rxp')
+                     and not e.name.endswith('.residual.rxp')]
         if rxp_files:
-            rxp_file = rxp_files[0]
+            rxp_file = Path(rxp_files[0].path)
             scan_name = rxp_file.stem
 
     if rxp_file is None:
         return None
 
     # RDBX file in project.rdb/SCANS/ScanPosXXX/SINGLESCANS/scan_name/
-    rdbx_file = project_path / "project.rdb" / "SCANS" / scan_pos_name / "SINGLESCANS" / scan_name / f"{scan_name}.rdbx"
+    rdbx_dir = project_path / "project.rdb" / "SCANS" / scan_pos_name / "SINGLESCANS" / scan_name
+    rdbx_file = rdbx_dir / f"{scan_name}.rdbx"
 
     # Transform file - check both standard location and DAT directory
-    transform_file = project_path / "DAT" / f"{scan_pos_name}.DAT"
-    if not transform_file.exists():
-        transform_file = project_path / "project.rdb" / "SCANS" / f"{scan_pos_name}.DAT"
-
-    if not transform_file.exists():
+    transform_file = None
+    possible_dirs = [
+        project_path / "DAT",
+        project_path / "project.rdb" / "SCANS",
+    ]
+
+    for loc in possible_dirs:
+        if f"{scan_pos_name}.DAT" in batch.list_directory(str(loc)):
+            transform_file = loc / f"{scan_pos_name}.DAT"
+            break
+
+    if transform_file is None:
         return None
 
     return {
         'rxp_file': str(rxp_file),
-        'rdbx_file': str(rdbx_file) if rdbx_file.exists() else None,
+        'rdbx_file': str(rdbx_file) if rdbx_file.name in batch.list_directory(str(rdbx_dir)) else None,
         'transform_file': str(transform_file),
         'scan_name': scan_name,
         'scan_pos': scan_pos_name
     }
 
 
+def get_sensor_position(scan_info, sensor_positions=None):
+    """
+    Get the sensor position of a scan, reading the transform only if not cached.
+
+    Args:
+        scan_info: Dictionary with scan file paths
+        sensor_positions: Optional dictionary of (x, y, z) sensor positions
+            keyed by transform file (see batch.read_sensor_positions)
+
+    Returns:
+        Tuple of sensor (x, y, z) coordinates
+    """
+    if sensor_positions is not None and scan_info['transform_file'] in sensor_positions:
+        return sensor_positions[scan_info['transform_file']]
+    transform_matrix = riegl_io.read_transform_file(scan_info['transform_file'])
+    return tuple(transform_matrix[3, :3])
+
+
+def use_rxp_only(scan_info):
+    """
+    Check if a scan has to be read from the RXP file only (no RDBX file).
+    """
+    return scan_info['rdbx_file'] is None or not os.path.exists(scan_info['rdbx_file'])
+
+
+def fit_ground_plane(scan_files, grid_origin, grid_extent=60, grid_resolution=10):
+    """
+    Fit a ground plane to the minimum Z grid of one or more scans.
+
+    Args:
+        scan_files: List of scan file dictionaries
+        grid_origin: Grid center [x, y]
+        grid_extent: Grid width (m)
+        grid_resolution: Grid cell size (m)
+
+    Returns:
+        Plane fit dictionary from plant_profile.plane_fit_hubers
+    """
+    # Use RDBX if available for all scans, otherwise RXP only
+    rxp_mode = any(use_rxp_only(scan_info) for scan_info in scan_files)
+
+    if rxp_mode:
+        files = [scan_info['rxp_file'] for scan_info in scan_files]
+    else:
+        files = [scan_info['rdbx_file'] for scan_info in scan_files]
+
+    transforms = [scan_info['transform_file'] for scan_info in scan_files]
+
+    # Get minimum Z grid for ground plane fitting
+    # This keeps at most one point per grid cell, so the Huber fit input
+    # is bounded by the grid size ((grid_extent / grid_resolution + 1)**2)
+    x, y, z, r = plant_profile.get_min_z_grid(
+        files, transforms,
+        grid_extent, grid_resolution,
+        grid_origin=grid_origin,
+        rxp=rxp_mode
+    )
+
+    # Weight by inverse range, dropping cells with a zero or invalid range
+    # so they cannot produce inf/NaN weights in the fit
+    w = np.reciprocal(r, where=r > 0, out=np.zeros_like(r))
+    mask = w > 0
+    x, y, z, w = x[mask], y[mask], z[mask], w[mask]
+
+    # Fit ground plane using Huber's method
+    return plant_profile.plane_fit_hubers(x, y, z, w=w)
+
+
+def add_scan_position(vpp, scan_info, reflectance_threshold=-20, method='WEIGHTED'):
+    """
+    Add a scan position to a vertical plant profile with a reflectance filter.
+
+    Args:
+        vpp: plant_profile.Jupp2009 instance
+        scan_info: Dictionary with scan file paths
+        reflectance_threshold: Minimum reflectance value
+        method: Pgap estimation method (WEIGHTED, FIRST, or ALL)
+    """
+    query_str = [f'reflectance > {reflectance_threshold}']
+
+    vpp.add_riegl_scan_position(
+        scan_info['rxp_file'],
+        scan_info['transform_file'],
+        sensor_height=None,
+        rdbx_file=None if use_rxp_only(scan_info) else scan_info['rdbx_file'],
+        method=method,
+        min_zenith=vpp.min_z,
+        max_zenith=vpp.max_z,
+        query_str=query_str
+    )
+
+
+def calc_plant_profiles(vpp):
+    """
+    Calculate the PAI and PAVD profiles from all the scan positions
+    added to a vertical plant profile.
+
+    Args:
+        vpp: plant_profile.Jupp2009 instance
+
+    Returns:
+        Dictionary with profile results
+    """
+    # Compute Pgap by zenith bin
+    vpp.get_pgap_theta_z()
+
+    # Calculate plant profiles using all three methods, sharing the
+    # log(Pgap) and zenith angle terms between them
+    prep = vpp.get_pgap_derivatives()
+    hinge_pai = vpp.calcHingePlantProfiles(prep=prep)
+    weighted_pai = vpp.calcSolidAnglePlantProfiles(total_pai=np.max(hinge_pai), prep=prep)
+    linear_pai, linear_mla = vpp.calcLinearPlantProfiles(calc_mla=True, prep=prep)
+
+    # Convert to PAVD
+    hinge_pavd, linear_pavd, weighted_pavd = vpp.get_pavd(
+        np.vstack([hinge_pai, linear_pai, weighted_pai]))
+
+    return {
+        'height_bin': vpp.height_bin,
+        'pgap_theta_z': vpp.pgap_theta_z,
+        'hinge_pai': hinge_pai,
+        'linear_pai': linear_pai,
+        'weighted_pai': weighted_pai,
+        'hinge_pavd': hinge_pavd,
+        'linear_pavd': linear_pavd,
+        'weighted_pavd': weighted_pavd,
+        'linear_mla': linear_mla,
+        'total_pai_hinge': np.sum(hinge_pai) * vpp.hres,
+        'total_pai_linear': np.sum(linear_pai) * vpp.hres,
+        'total_pai_weighted': np.sum(weighted_pai) * vpp.hres,
+    }
+
+
 def process_scan_position(scan_info, hres=0.5, zres=5, ares=90,
                          min_z=35, max_z=70, min_h=0, max_h=50,
-                         reflectance_threshold=-20, method='WEIGHTED'):
+                         reflectance_threshold=-20, method='WEIGHTED',
+                         sensor_positions=None):
     """
     Process a single scan position to generate PAVD profiles.
 
@@ -118,40 +242,17 @@ def process_scan_position(scan_info, hres=0.5, zres=5, ares=90,
         max_h: Maximum height (m)
         reflectance_threshold: Minimum reflectance value
         method: Pgap estimation method (WEIGHTED, FIRST, or ALL)
+        sensor_positions: Optional dictionary of (x, y, z) sensor positions
+            keyed by transform file (see batch.read_sensor_positions)
 
     Returns:
         Dictionary with profile results
     """
-    # Read transform to get sensor position
-    transform_matrix = riegl_io.read_transform_file(scan_info['transform_file'])
-    x0, y0, z0, _ = transform_matrix[3, :]
-
-    # Fit ground plane
-    grid_extent = 60
-    grid_resolution = 10
-    grid_origin = [x0, y0]
+    x0, y0, z0 = get_sensor_position(scan_info, sensor_positions)
 
     try:
-        # Use RDBX if available, otherwise RXP only
-        rxp_mode = scan_info['rdbx_file'] is None or not os.path.exists(scan_info['rdbx_file'])
-
-        if rxp_mode:
-            files = [scan_info['rxp_file']]
-        else:
-            files = [scan_info['rdbx_file']]
-
-        transforms = [scan_info['transform_file']]
-
-        # Get minimum Z grid for ground plane fitting
-        x, y, z, r = plant_profile.get_min_z_grid(
-            files, transforms,
-            grid_extent, grid_resolution,
-            grid_origin=grid_origin,
-            rxp=rxp_mode
-        )
-
-        # Fit ground plane using Huber's method
-        planefit = plant_profile.plane_fit_hubers(x, y, z, w=1/r)
+        # Fit ground plane
+        planefit = fit_ground_plane([scan_info], [x0, y0])
 
         # Initialize vertical plant profile
         vpp = plant_profile.Jupp2009(
@@ -161,32 +262,8 @@ def process_scan_position(scan_info, hres=0.5, zres=5, ares=90,
             ground_plane=planefit['Parameters']
         )
 
-        # Add scan position with reflectance filter
-        query_str = [f'reflectance > {reflectance_threshold}']
-
-        vpp.add_riegl_scan_position(
-            scan_info['rxp_file'],
-            scan_info['transform_file'],
-            sensor_height=None,
-            rdbx_file=scan_info['rdbx_file'] if not rxp_mode else None,
-            method=method,
-            min_zenith=min_z,
-            max_zenith=max_z,
-            query_str=query_str
-        )
-
-        # Compute Pgap by zenith bin
-        vpp.get_pgap_theta_z()
-
-        # Calculate plant profiles using all three methods
-        hinge_pai = vpp.calcHingePlantProfiles()
-        weighted_pai = vpp.calcSolidAnglePlantProfiles()
-        linear_pai, linear_mla = vpp.calcLinearPlantProfiles(calc_mla=True)
-
-        # Convert to PAVD
-        hinge_pavd = vpp.get_pavd(hinge_pai)
-        linear_pavd = vpp.get_pavd(linear_pai)
-        weighted_pavd = vpp.get_pavd(weighted_pai)
+        add_scan_position(vpp, scan_info,
+            reflectance_threshold=reflectance_threshold, method=method)
 
         return {
             'success': True,
@@ -194,18 +271,7 @@ def process_scan_position(scan_info, hres=0.5, zres=5, ares=90,
             'scan_name': scan_info['scan_name'],
             'sensor_position': [x0, y0, z0],
             'ground_plane': planefit['Parameters'],
-            'height_bin': vpp.height_bin,
-            'pgap_theta_z': vpp.pgap_theta_z,
-            'hinge_pai': hinge_pai,
-            'linear_pai': linear_pai,
-            'weighted_pai': weighted_pai,
-            'hinge_pavd': hinge_pavd,
-            'linear_pavd': linear_pavd,
-            'weighted_pavd': weighted_pavd,
-            'linear_mla': linear_mla,
-            'total_pai_hinge': np.sum(hinge_pai) * hres,
-            'total_pai_linear': np.sum(linear_pai) * hres,
-            'total_pai_weighted': np.sum(weighted_pai) * hres,
+            **calc_plant_profiles(vpp)
         }
 
     except Exception as e:
@@ -217,61 +283,307 @@ def process_scan_position(scan_info, hres=0.5, zres=5, ares=90,
         }
 
 
-def save_results(results, output_dir):
+def process_merged_scans(scan_files, name, hres=0.5, zres=5, ares=90,
+                         min_z=35, max_z=70, min_h=0, max_h=50,
+                         reflectance_threshold=-20, method='WEIGHTED',
+                         sensor_positions=None):
     """
-    Save processing results to CSV files.
+    Process all scan positions together to generate a single set of
+    PAVD profiles, with one ground plane fitted to all the scans.
+
+    Args:
+        scan_files: List of scan file dictionaries
+        name: Name used for the merged profile (in place of the scan name)
+        Other arguments as for process_scan_position
+
+    Returns:
+        Dictionary with profile results
+    """
+    positions = np.array([get_sensor_position(scan_info, sensor_positions)
+                          for scan_info in scan_files])
+    x0, y0, z0 = positions.mean(axis=0)
+
+    # Extend the ground plane grid to cover all the scan positions
+    grid_resolution = 10
+    span = np.max(np.ptp(positions[:, :2], axis=0))
+    grid_extent = 60 + np.ceil(span / grid_resolution) * grid_resolution
+
+    try:
+        planefit = fit_ground_plane(scan_files, [x0, y0], grid_extent=grid_extent,
+            grid_resolution=grid_resolution)
+
+        # Add all scan positions to the same vertical plant profile
+        vpp = plant_profile.Jupp2009(
+            hres=hres, zres=zres, ares=ares,
+            min_z=min_z, max_z=max_z,
+            min_h=min_h, max_h=max_h,
+            ground_plane=planefit['Parameters']
+        )
+        for scan_info in tqdm(scan_files, desc="Adding scans"):
+            add_scan_position(vpp, scan_info,
+                reflectance_threshold=reflectance_threshold, method=method)
+
+        return {
+            'success': True,
+            'scan_pos': 'merged',
+            'scan_name': name,
+            'sensor_position': [x0, y0, z0],
+            'ground_plane': planefit['Parameters'],
+            **calc_plant_profiles(vpp)
+        }
+
+    except Exception as e:
+        return {
+            'success': False,
+            'scan_pos': 'merged',
+            'scan_name': name,
+            'error': str(e)
+        }
+
+
+def get_profile_dataframe(result):
+    """
+    Get the detailed profiles of a single scan as a DataFrame.
+
+    Args:
+        result: Result dictionary from process_scan_position
+
+    Returns:
+        DataFrame with height bins and all profile types
+    """
+    return pd.DataFrame({
+        'height': result['height_bin'],
+        'hinge_pai': result['hinge_pai'],
+        'linear_pai': result['linear_pai'],
+        'weighted_pai': result['weighted_pai'],
+        'hinge_pavd': result['hinge_pavd'],
+        'linear_pavd': result['linear_pavd'],
+        'weighted_pavd': result['weighted_pavd'],
+        'linear_mla': result['linear_mla'],
+    })
+
+
+def write_dataframe(df, filename, output_format='csv'):
+    """
+    Write a DataFrame to a temporary file and move it into place, so an
+    interrupted run never leaves a partial output file.
+
+    Args:
+        df: DataFrame to write
+        filename: Output file path
+        output_format: Output file format ('csv' or 'parquet')
+    """
+    tmp_file = Path(f'{filename}.tmp')
+    if output_format == 'parquet':
+        df.to_parquet(tmp_file, index=False, compression='zstd')
+    else:
+        df.to_csv(tmp_file, index=False)
+    os.replace(tmp_file, filename)
+
+
+def write_profile_csv(result, output_dir):
+    """
+    Write the detailed profiles of a single scan to CSV.
+
+    Args:
+        result: Result dictionary from process_scan_position
+        output_dir: Output directory path
+
+    Returns:
+        Path of the profile CSV file
+    """
+    profile_df = get_profile_dataframe(result)
+
+    profile_file = Path(output_dir) / f'{result["scan_pos"]}_{result["scan_name"]}_profiles.csv'
+    write_dataframe(profile_df, profile_file)
+
+    return profile_file
+
+
+def remove_processed_scans(scan_files, output_dir, output_format='csv'):
+    """
+    Remove the scans that already have a summary row and detailed profiles
+    in the output directory.
+
+    Args:
+        scan_files: List of scan file dictionaries
+        output_dir: Output directory path
+        output_format: Output format of the previous run ('csv' or 'parquet')
+
+    Returns:
+        List of scan file dictionaries still to be processed
+    """
+    output_path = Path(output_dir)
+    columns = ['scan_pos', 'scan_name']
+
+    summarized = set()
+    summary_file = output_path / f'pavd_summary.{output_format}'
+    if summary_file.exists():
+        if output_format == 'parquet':
+            df = pd.read_parquet(summary_file, columns=columns)
+        else:
+            df = pd.read_csv(summary_file, usecols=columns, dtype=str)
+        summarized = set(df.itertuples(index=False, name=None))
+
+    if output_format == 'parquet':
+        processed = set()
+        profile_file = output_path / 'pavd_profiles.parquet'
+        if profile_file.exists():
+            df = pd.read_parquet(profile_file, columns=columns)
+            processed = set(df.drop_duplicates().itertuples(index=False, name=None))
+    else:
+        existing = batch.list_directory(str(output_path))
+        processed = {(s['scan_pos'], s['scan_name']) for s in scan_files
+                     if f'{s["scan_pos"]}_{s["scan_name"]}_profiles.csv' in existing}
+
+    done = summarized & processed
+    return [s for s in scan_files if (s['scan_pos'], s['scan_name']) not in done]
+
+
+def merge_existing_output(df, filename, output_format='csv'):
+    """
+    Merge new rows with an existing output file, replacing the rows of
+    any scan positions that were processed again.
+
+    Args:
+        df: DataFrame of new rows with a scan_pos column
+        filename: Existing output file path
+        output_format: Output file format ('csv' or 'parquet')
+
+    Returns:
+        Merged DataFrame sorted by scan position
+    """
+    if not Path(filename).exists():
+        return df
+
+    if output_format == 'parquet':
+        existing = pd.read_parquet(filename)
+    else:
+        existing = pd.read_csv(filename)
+    existing = existing[~existing['scan_pos'].isin(df['scan_pos'])]
+
+    merged = pd.concat([existing, df], ignore_index=True)
+    return merged.sort_values('scan_pos', kind='stable', ignore_index=True)
+
+
+def get_summary_row(result):
+    """
+    Get the summary statistics of a single scan.
+
+    Args:
+        result: Result dictionary from process_scan_position
+
+    Returns:
+        Dictionary of summary values
+    """
+    row = {
+        'scan_pos': result['scan_pos'],
+        'scan_name': result['scan_name'],
+        'sensor_x': result['sensor_position'][0],
+        'sensor_y': result['sensor_position'][1],
+        'sensor_z': result['sensor_position'][2],
+        'ground_intercept': result['ground_plane'][0],
+        'ground_slope_x': result['ground_plane'][1],
+        'ground_slope_y': result['ground_plane'][2],
+        'total_pai_hinge': result['total_pai_hinge'],
+        'total_pai_linear': result['total_pai_linear'],
+        'total_pai_weighted': result['total_pai_weighted'],
+    }
+    row.update({k: result[k] for k in batch.PROFILE_KEYS if k in result})
+    return row
+
+
+def write_summary(results, output_dir, output_format='csv', append=False):
+    """
+    Write the summary statistics of the successful scans.
+
+    Args:
+        results: List of result dictionaries
+        output_dir: Output directory path
+        output_format: Output file format ('csv' or 'parquet')
+        append: Keep the rows of other scans in an existing summary file
+
+    Returns:
+        Path of the summary file, or None if there were no successful scans
+    """
+    summary_data = [get_summary_row(result) for result in results if result['success']]
+    if not summary_data:
+        return None
+
+    summary_df = pd.DataFrame(summary_data)
+    summary_file = Path(output_dir) / f'pavd_summary.{output_format}'
+    if append:
+        summary_df = merge_existing_output(summary_df, summary_file, output_format)
+    write_dataframe(summary_df, summary_file, output_format)
+
+    return summary_file
+
+
+def append_summary_row(result, summary_file):
+    """
+    Append the summary row of a single scan to a CSV summary file.
+
+    Rows follow the columns of an existing file, so a file written with
+    a different set of columns (e.g., without --profile) stays readable.
+
+    Args:
+        result: Result dictionary from process_scan_position
+        summary_file: CSV summary file path
+    """
+    row = pd.DataFrame([get_summary_row(result)])
+    summary_file = Path(summary_file)
+    if not summary_file.exists() or summary_file.stat().st_size == 0:
+        row.to_csv(summary_file, index=False)
+        return
+
+    columns = pd.read_csv(summary_file, nrows=0).columns
+    with open(summary_file, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        complete = f.read(1) == b'\n'
+    with open(summary_file, 'a', newline='') as f:
+        # Finish a row left incomplete by an interrupted run
+        if not complete:
+            f.write('\n')
+        row.reindex(columns=columns).to_csv(f, header=False, index=False)
+
+
+def save_results(results, output_dir, output_format='csv', append=False):
+    """
+    Save the summary, and for Parquet output the detailed profiles, of the
+    processing results. Profile CSV files are written by main as the scans
+    complete (see write_profile_csv).
 
     Args:
         results: List of result dictionaries
         output_dir: Output directory path
+        output_format: 'csv' for one profile file per scan, or 'parquet'
+            for a single long-format profile file for all scans
+        append: Keep the results of other scans in existing output files
     """
     output_path = Path(output_dir)
     output_path.mkdir(parents=True, exist_ok=True)
 
     # Save summary statistics
-    summary_data = []
-    for result in results:
-        if result['success']:
-            summary_data.append({
-                'scan_pos': result['scan_pos'],
-                'scan_name': result['scan_name'],
-                'sensor_x': result['sensor_position'][0],
-                'sensor_y': result['sensor_position'][1],
-                'sensor_z': result['sensor_position'][2],
-                'ground_intercept': result['ground_plane'][0],
-                'ground_slope_x': result['ground_plane'][1],
-                'ground_slope_y': result['ground_plane'][2],
-                'total_pai_hinge': result['total_pai_hinge'],
-                'total_pai_linear': result['total_pai_linear'],
-                'total_pai_weighted': result['total_pai_weighted'],
-            })
-
-    if summary_data:
-        summary_df = pd.DataFrame(summary_data)
-        summary_df.to_csv(output_path / 'pavd_summary.csv', index=False)
-        print(f"\nSaved summary to {output_path / 'pavd_summary.csv'}")
-
-    # Save detailed profiles for each successful scan
-    for result in results:
-        if result['success']:
-            scan_pos = result['scan_pos']
-
-            # Create DataFrame with height bins and all profile types
-            profile_df = pd.DataFrame({
-                'height': result['height_bin'],
-                'hinge_pai': result['hinge_pai'],
-                'linear_pai': result['linear_pai'],
-                'weighted_pai': result['weighted_pai'],
-                'hinge_pavd': result['hinge_pavd'],
-                'linear_pavd': result['linear_pavd'],
-                'weighted_pavd': result['weighted_pavd'],
-                'linear_mla': result['linear_mla'],
-            })
-
-            profile_file = output_path / f'{scan_pos}_{result["scan_name"]}_profiles.csv'
-            profile_df.to_csv(profile_file, index=False)
-
-    print(f"Saved {len([r for r in results if r['success']])} detailed profile files to {output_path}")
+    summary_file = write_summary(results, output_path, output_format=output_format,
+                                 append=append)
+    if summary_file is not None:
+        print(f"\nSaved summary to {summary_file}")
+
+    successful = [result for result in results if result['success']]
+    if output_format == 'parquet':
+        # Save detailed profiles for all scans to a single long-format file
+        profile_dfs = []
+        for result in successful:
+            df = get_profile_dataframe(result)
+            df.insert(0, 'scan_name', result['scan_name'])
+            df.insert(0, 'scan_pos', result['scan_pos'])
+            profile_dfs.append(df)
+        profile_df = pd.concat(profile_dfs, ignore_index=True)
+        profile_file = output_path / 'pavd_profiles.parquet'
+        if append:
+            profile_df = merge_existing_output(profile_df, profile_file, output_format)
+        write_dataframe(profile_df, profile_file, output_format)
+        print(f"Saved detailed profiles for {len(successful)} scans to {profile_file}")
 
 
 def main():
@@ -341,46 +653,123 @@ def main():
         default='WEIGHTED',
         help='Pgap estimation method (default: WEIGHTED)'
     )
+    parser.add_argument(
+        '--format',
+        choices=['csv', 'parquet'],
+        default='csv',
+        help='Output format: one CSV per scan, or a single Parquet file of all scans (default: csv)'
+    )
+    parser.add_argument(
+        '--skip-existing',
+        action='store_true',
+        help='Skip scans that already have profiles in the output directory'
+    )
+    parser.add_argument(
+        '--merge-scans',
+        action='store_true',
+        help='Combine all scans into a single profile with one ground plane'
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=os.cpu_count(),
+        help='Number of scans to process in parallel (default: number of CPUs)'
+    )
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='Record the wall time and peak memory of each scan in the summary'
+    )
 
     args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+    if args.format == 'parquet' and importlib.util.find_spec('pyarrow') is None:
+        parser.error('--format parquet requires pyarrow')
+    if args.merge_scans and args.skip_existing:
+        parser.error('--skip-existing cannot be used with --merge-scans')
+
+    output_path = Path(args.output)
+    output_path.mkdir(parents=True, exist_ok=True)
 
-    # Find all scan positions
+    # Find all scan positions and get file paths for each scan position
     print(f"Scanning RISCAN project: {args.riscan_project}")
-    scan_positions = find_scan_positions(args.riscan_project)
-    print(f"Found {len(scan_positions)} scan positions")
-
-    # Get file paths for each scan position
-    project_path = Path(args.riscan_project)
-    scan_files = []
-    for scan_pos in scan_positions:
-        files = get_scan_files(scan_pos, project_path)
-        if files:
-            scan_files.append(files)
-        else:
-            print(f"Warning: Skipping {scan_pos.name} - missing required files")
+    scan_files, skipped = batch.discover_scan_files(args.riscan_project, get_scan_files)
+    print(f"Found {len(scan_files) + len(skipped)} scan positions")
+    for name in skipped:
+        print(f"Warning: Skipping {name} - missing required files")
+
+    # Skip scans processed by a previous run
+    if args.skip_existing:
+        nscans = len(scan_files)
+        scan_files = remove_processed_scans(scan_files, output_path, output_format=args.format)
+        print(f"Skipping {nscans - len(scan_files)} scans with existing profiles")
+        if not scan_files:
+            print("All scans have already been processed")
+            return 0
 
     print(f"Processing {len(scan_files)} scans with valid file sets")
 
-    # Process each scan
-    results = []
-    for scan_info in tqdm(scan_files, desc="Processing scans"):
-        result = process_scan_position(
-            scan_info,
-            hres=args.hres,
-            zres=args.zres,
-            ares=args.ares,
-            min_z=args.min_zenith,
-            max_z=args.max_zenith,
-            min_h=args.min_height,
-            max_h=args.max_height,
-            reflectance_threshold=args.reflectance_threshold,
-            method=args.method
-        )
+    # Read each sensor position once for all the workers
+    sensor_positions = batch.read_sensor_positions([s['transform_file'] for s in scan_files])
+
+    # Process each scan, or all scans together
+    kwargs = dict(
+        hres=args.hres,
+        zres=args.zres,
+        ares=args.ares,
+        min_z=args.min_zenith,
+        max_z=args.max_zenith,
+        min_h=args.min_height,
+        max_h=args.max_height,
+        reflectance_threshold=args.reflectance_threshold,
+        method=args.method,
+        sensor_positions=sensor_positions
+    )
 
-        if not result['success']:
-            print(f"\nError processing {result['scan_pos']}: {result['error']}")
+    # Write each profile CSV as soon as its scan completes, overlapping the
+    # writes with the scans still being processed. CSV writing is I/O bound
+    # so the writes run in a thread pool. Summary rows are also appended as
+    # scans complete, so an interrupted run can be resumed with
+    # --skip-existing
+    summary_file = output_path / 'pavd_summary.csv'
+    if args.format == 'csv' and not args.skip_existing and summary_file.exists():
+        summary_file.unlink()
 
-        results.append(result)
+    results = []
+    writes = []
+    with ThreadPoolExecutor(max_workers=8) as writer:
+        if args.merge_scans:
+            name = Path(args.riscan_project).stem
+            if args.profile:
+                result = batch.profile_worker(process_merged_scans, scan_files, name, **kwargs)
+            else:
+                result = process_merged_scans(scan_files, name, **kwargs)
+            if not result['success']:
+                print(f"\nError processing merged scans: {result['error']}")
+            results.append(result)
+            if result['success'] and args.format == 'csv':
+                writes.append(writer.submit(write_profile_csv, result, output_path))
+        else:
+            worker = functools.partial(process_scan_position, **kwargs)
+            if args.profile:
+                worker = functools.partial(batch.profile_worker, worker)
+            for result in tqdm(batch.run_scans(worker, scan_files, jobs=args.jobs),
+                               total=len(scan_files), desc="Processing scans"):
+                if not result['success']:
+                    print(f"\nError processing {result['scan_pos']}: {result['error']}")
+
+                results.append(result)
+                if result['success'] and args.format == 'csv':
+                    writes.append(writer.submit(write_profile_csv, result, output_path))
+                    append_summary_row(result, summary_file)
+
+    # Raise any errors from the profile writes
+    for write in writes:
+        write.result()
+
+    # Keep the output order independent of scan completion order
+    results.sort(key=lambda r: r['scan_pos'])
 
     # Save results
     successful = len([r for r in results if r['success']])
@@ -388,7 +777,10 @@ def main():
     print(f"\nProcessing complete: {successful} successful, {failed} failed")
 
     if successful > 0:
-        save_results(results, args.output)
+        save_results(results, args.output, output_format=args.format,
+                     append=args.skip_existing)
+        if args.format == 'csv':
+            print(f"Saved {len(writes)} detailed profile files to {output_path}")
     else:
         print("No scans processed successfully")
         return 1
@@ -7,38 +7,28 @@ voxel-based models of directional gap probability (Pgap) and Plant Area Index (P
 """
 
 import os
+import gc
+import re
 import sys
 import argparse
 import json
+import functools
+import importlib.util
 from pathlib import Path
-import glob
 import numpy as np
+from numpy.lib.format import open_memmap
 from tqdm import tqdm
 
-from pylidar_tls_canopy import voxelization, riegl_io
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
+from pylidar_tls_canopy import voxelization, batch
 
-def find_scan_positions(riscan_project):
-    """
-    Find all scan positions in a RISCAN project.
-
-    Args:
-        riscan_project: Path to RISCAN project directory (.RiSCAN folder)
 
-    Returns:
-        List of scan position directories
-    """
-    project_path = Path(riscan_project)
-    scans_dir = project_path / "SCANS"
-
-    if not scans_dir.exists():
-        raise FileNotFoundError(f"SCANS directory not found in {riscan_project}")
-
-    # Find all ScanPos directories
-    scan_positions = sorted([d for d in scans_dir.iterdir()
-                            if d.is_dir() and d.name.startswith("ScanPos")])
-
-    return scan_positions
+# Singlescan RXP filenames (YYMMDD_HHMMSS.rxp)
+RXP_PATTERN = re.compile(r'\d{6}_\d{6}\.rxp')
 
 
 def get_scan_files(scan_pos_dir, project_path):
@@ -56,31 +46,34 @@ def get_scan_files(scan_pos_dir, project_path):
 
     # Find RXP file in SCANS/ScanPosXXX/SINGLESCANS/
     singlescans_dir = scan_pos_dir / "SINGLESCANS"
-    if not singlescans_dir.exists():
-        return None
 
-    # Get all singlescan directories and find the most recent one
-    pattern = str(singlescans_dir / "??????_??????.rxp")
-    rxp_files = glob.glob(pattern)
-    if not rxp_files:
+    # Get all singlescan files and find the most recent one
+    # DirEntry.stat() is cached so each file is only stat'ed once
+    try:
+        with os.scandir(singlescans_dir) as it:
+            rxp_entries = [e for e in it if RXP_PATTERN.fullmatch(e.name)]
+    except FileNotFoundError:
+        return None
+    if not rxp_entries:
         return None
 
-    rxp_file = max(rxp_files, key=os.path.getctime)
+    rxp_file = max(rxp_entries, key=lambda e: e.stat().st_ctime).path
     scan_name = Path(rxp_file).stem
 
     # RDBX file in project.rdb/SCANS/ScanPosXXX/SINGLESCANS/scan_name/
-    rdbx_file = project_path / "project.rdb" / "SCANS" / scan_pos_name / "SINGLESCANS" / scan_name / f"{scan_name}.rdbx"
+    rdbx_dir = project_path / "project.rdb" / "SCANS" / scan_pos_name / "SINGLESCANS" / scan_name
+    rdbx_file = rdbx_dir / f"{scan_name}.rdbx"
 
     # Transform file - check multiple possible locations
     transform_file = None
-    possible_locations = [
-        project_path / "SCANS" / "matrix" / f"{scan_pos_name}.DAT",
-        project_path / "project.rdb" / "SCANS" / f"{scan_pos_name}.DAT",
+    possible_dirs = [
+        project_path / "SCANS" / "matrix",
+        project_path / "project.rdb" / "SCANS",
     ]
 
-    for loc in possible_locations:
-        if loc.exists():
-            transform_file = loc
+    for loc in possible_dirs:
+        if f"{scan_pos_name}.DAT" in batch.list_directory(str(loc)):
+            transform_file = loc / f"{scan_pos_name}.DAT"
             break
 
     if transform_file is None:
@@ -88,61 +81,55 @@ def get_scan_files(scan_pos_dir, project_path):
 
     return {
         'rxp_file': str(rxp_file),
-        'rdbx_file': str(rdbx_file) if rdbx_file.exists() else None,
+        'rdbx_file': str(rdbx_file) if rdbx_file.name in batch.list_directory(str(rdbx_dir)) else None,
         'transform_file': str(transform_file),
         'scan_name': scan_name,
         'scan_pos': scan_pos_name
     }
 
 
-def compute_bounds(transform_files, buffer=5, hmax=50):
+def compute_bounds(sensor_positions, buffer=5, hmax=50):
     """
     Compute voxelization bounds from scan positions.
 
     Args:
-        transform_files: List of transform file paths
+        sensor_positions: List of (x, y, z) sensor positions
         buffer: Buffer to extend bounds (m)
         hmax: Maximum tree height (m)
 
     Returns:
         Array of bounds [xmin, ymin, zmin, xmax, ymax, zmax]
     """
-    # xmin, ymin, zmin, xmax, ymax, zmax
-    bounds = np.array([np.Inf, np.Inf, np.Inf, -np.Inf, -np.Inf, -np.Inf])
-
-    for fn in transform_files:
-        transform_matrix = riegl_io.read_transform_file(fn)
-        x_tmp, y_tmp, z_tmp, _ = transform_matrix[3, :]
-        bounds[0] = x_tmp if x_tmp < bounds[0] else bounds[0]
-        bounds[1] = y_tmp if y_tmp < bounds[1] else bounds[1]
-        bounds[2] = z_tmp if z_tmp < bounds[2] else bounds[2]
-        bounds[3] = x_tmp if x_tmp > bounds[3] else bounds[3]
-        bounds[4] = y_tmp if y_tmp > bounds[4] else bounds[4]
-        bounds[5] = z_tmp if z_tmp > bounds[5] else bounds[5]
-
-    # Round and extend bounds
-    bounds[0:3] = (bounds[0:3] - buffer) // buffer * buffer
-    bounds[3:6] = (bounds[3:6] + 1.5 * buffer) // buffer * buffer
+    # xmin, ymin, zmin, xmax, ymax, zmax rounded and extended by the buffer
+    positions = np.array(list(sensor_positions), dtype=float).reshape(-1, 3)
+    bounds = np.concatenate([
+        np.floor_divide(positions.min(axis=0) - buffer, buffer),
+        np.floor_divide(positions.max(axis=0) + 1.5 * buffer, buffer)
+    ]) * buffer
     bounds[2] -= buffer
     bounds[5] += hmax
 
     return bounds
 
 
-def process_scan_position(scan_info, bounds, voxelsize, dtm_filename=None,
-                         save_counts=True):
+def process_scan_position(scan_info, bounds, voxelsize, output_dir,
+                         dtm_filename=None, save_counts=True,
+                         file_format='tif', dtype='float32'):
     """
-    Process a single scan position to generate voxel grids.
+    Process a single scan position to generate and write voxel grids.
 
     Args:
         scan_info: Dictionary with scan file paths
         bounds: Voxelization bounds [xmin, ymin, zmin, xmax, ymax, zmax]
         voxelsize: Voxel resolution (m)
+        output_dir: Output directory for voxel grids
         dtm_filename: Optional DTM file path
         save_counts: Save hit/miss/occluded counts
+        file_format: Voxel grid file format ('tif', 'zarr' or 'npy')
+        dtype: Voxel grid data type ('float32', or 'float16' for zarr and npy)
 
     Returns:
-        Dictionary with voxel grid filenames
+        Dictionary with voxel grid filenames (the grids are not returned)
     """
     try:
         # Initialize voxel grid
@@ -158,11 +145,20 @@ def process_scan_position(scan_info, bounds, voxelsize, dtm_filename=None,
         # Voxelize scan
         vgrid.voxelize_scan(bounds, voxelsize, save_counts=save_counts)
 
+        # Write voxel grids for this scan
+        prefix = str(Path(output_dir) / scan_info['scan_name'])
+        vgrid.write_grids(prefix, file_format=file_format, dtype=dtype)
+        filenames = vgrid.filenames
+
+        # Release the dense grids before the next scan is voxelized
+        del vgrid
+        gc.collect()
+
         return {
             'success': True,
             'scan_pos': scan_info['scan_pos'],
             'scan_name': scan_info['scan_name'],
-            'vgrid': vgrid
+            'filenames': filenames
         }
 
     except Exception as e:
@@ -174,6 +170,78 @@ def process_scan_position(scan_info, bounds, voxelsize, dtm_filename=None,
         }
 
 
+def get_existing_grids(scan_name, output_dir, save_counts=True, file_format='tif'):
+    """
+    Get the voxel grid filenames of a scan voxelized by a previous run.
+
+    Args:
+        scan_name: Scan name used as the voxel grid filename prefix
+        output_dir: Output directory for voxel grids
+        save_counts: Whether the hit/miss/occluded count grids are required
+        file_format: Voxel grid file format ('tif', 'zarr' or 'npy')
+
+    Returns:
+        Dictionary of voxel grid filenames, or None if any grid is missing
+    """
+    names = ['vwts', 'pgap', 'zeni', 'vcls']
+    if save_counts:
+        names += ['hits', 'miss', 'occl', 'phit', 'pmiss']
+
+    existing = batch.list_directory(str(output_dir))
+    filenames = {}
+    for k in names:
+        fn = f'{scan_name}_{k}.{file_format}'
+        if fn not in existing:
+            return None
+        filenames[k] = str(Path(output_dir) / fn)
+
+    return filenames
+
+
+def write_config(config, config_file):
+    """
+    Write the voxelization configuration file atomically.
+
+    The file is written to a temporary file in the same directory and
+    then moved over config_file, so an interrupted run never leaves a
+    partial configuration file. orjson is used if it is installed.
+
+    Args:
+        config: Configuration dictionary
+        config_file: Output configuration file path
+    """
+    if orjson is not None:
+        data = orjson.dumps(config, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY)
+    else:
+        data = json.dumps(config, indent=2).encode()
+
+    # The temporary file is created with open() so it gets the usual
+    # permissions from the umask
+    tmp_file = Path(f'{config_file}.tmp')
+    try:
+        with open(tmp_file, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_file, config_file)
+    except BaseException:
+        tmp_file.unlink(missing_ok=True)
+        raise
+
+
+def add_result_to_config(config, result):
+    """
+    Add the voxel grid filenames and profiling results of a scan to the config.
+
+    Args:
+        config: Configuration dictionary
+        result: Result dictionary from process_scan_position
+    """
+    if result['success']:
+        config['positions'][result['scan_name']] = result['filenames']
+    if 'elapsed_s' in result:
+        config.setdefault('scan_profiles', {})[result['scan_name']] = {
+            k: result[k] for k in batch.PROFILE_KEYS if k in result}
+
+
 def main():
     parser = argparse.ArgumentParser(
         description='Batch voxelization for all scans in a RISCAN project'
@@ -216,6 +284,18 @@ def main():
         action='store_true',
         help='Do not save hit/miss/occluded count grids'
     )
+    parser.add_argument(
+        '--format',
+        choices=['tif', 'zarr', 'npy'],
+        default='tif',
+        help='Voxel grid file format; npy grids are memory mapped by the model (default: tif)'
+    )
+    parser.add_argument(
+        '--dtype',
+        choices=['float32', 'float16'],
+        default='float32',
+        help='Data type of the bounded voxel grids (pgap, zeni, vcls); float16 requires --format zarr or npy (default: float32)'
+    )
     parser.add_argument(
         '--min-n',
         type=int,
@@ -227,41 +307,65 @@ def main():
         action='store_true',
         help='Run the linear model to derive PAI and cover profiles after voxelization'
     )
+    parser.add_argument(
+        '--z-chunk',
+        type=int,
+        default=16,
+        help='Number of height layers read at once when running the model (default: 16)'
+    )
     parser.add_argument(
         '--weighted',
         action='store_true',
         help='Use weighted linear model (applies when --run-model is set)'
     )
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=os.cpu_count(),
+        help='Number of scans to voxelize in parallel (default: number of CPUs)'
+    )
+    parser.add_argument(
+        '--skip-existing',
+        action='store_true',
+        help='Skip scans that already have voxel grids from a previous run with the same bounds and voxel size'
+    )
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='Record the wall time and peak memory of each scan in the configuration file'
+    )
 
     args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+    if args.z_chunk < 1:
+        parser.error('--z-chunk must be at least 1')
+    if args.dtype == 'float16' and args.format == 'tif':
+        parser.error('--dtype float16 requires --format zarr or npy')
+    if args.format == 'zarr':
+        missing = [m for m in ('zarr', 'numcodecs') if importlib.util.find_spec(m) is None]
+        if missing:
+            parser.error(f"--format zarr requires {' and '.join(missing)}")
 
     # Create output directory
     output_path = Path(args.output)
     output_path.mkdir(parents=True, exist_ok=True)
 
-    # Find all scan positions
+    # Find all scan positions and get file paths for each scan position
     print(f"Scanning RISCAN project: {args.riscan_project}")
-    scan_positions = find_scan_positions(args.riscan_project)
-    print(f"Found {len(scan_positions)} scan positions")
-
-    # Get file paths for each scan position
     project_path = Path(args.riscan_project)
-    scan_files = []
-    transform_files = []
-
-    for scan_pos in scan_positions:
-        files = get_scan_files(scan_pos, project_path)
-        if files:
-            scan_files.append(files)
-            transform_files.append(files['transform_file'])
-        else:
-            print(f"Warning: Skipping {scan_pos.name} - missing required files")
+    scan_files, skipped = batch.discover_scan_files(args.riscan_project, get_scan_files)
+    print(f"Found {len(scan_files) + len(skipped)} scan positions")
+    for name in skipped:
+        print(f"Warning: Skipping {name} - missing required files")
+    transform_files = [files['transform_file'] for files in scan_files]
 
     print(f"Processing {len(scan_files)} scans with valid file sets")
 
     # Compute bounds from all scan positions
     print("Computing voxelization bounds...")
-    bounds = compute_bounds(transform_files, buffer=args.buffer, hmax=args.hmax)
+    sensor_positions = batch.read_sensor_positions(transform_files)
+    bounds = compute_bounds(sensor_positions.values(), buffer=args.buffer, hmax=args.hmax)
     print(f"Bounds: xmin={bounds[0]:.1f}, ymin={bounds[1]:.1f}, zmin={bounds[2]:.1f}, "
           f"xmax={bounds[3]:.1f}, ymax={bounds[4]:.1f}, zmax={bounds[5]:.1f}")
 
@@ -277,38 +381,84 @@ def main():
         'positions': {}
     }
 
+    # Reuse the grids of scans voxelized by a previous run with the same grid
+    # The configuration file lists the scans whose grids were completely
+    # written, including those of a run that did not finish
+    config_file = output_path / f"{project_path.stem}_config.json"
+    existing = []
+    if args.skip_existing:
+        previous = {}
+        if config_file.exists():
+            with open(config_file, 'r') as f:
+                previous = json.load(f)
+        if not previous:
+            print("Warning: No configuration file from a previous run, voxelizing all scans")
+        elif (previous.get('bounds') == config['bounds'] and
+              previous.get('resolution') == config['resolution']):
+            previous_profiles = previous.get('scan_profiles', {})
+            remaining = []
+            for scan_info in scan_files:
+                filenames = None
+                if scan_info['scan_name'] in previous.get('positions', {}):
+                    filenames = get_existing_grids(scan_info['scan_name'], output_path,
+                        save_counts=not args.no_counts, file_format=args.format)
+                if filenames is None:
+                    remaining.append(scan_info)
+                else:
+                    existing.append({
+                        'success': True,
+                        'scan_pos': scan_info['scan_pos'],
+                        'scan_name': scan_info['scan_name'],
+                        'filenames': filenames,
+                        **previous_profiles.get(scan_info['scan_name'], {})
+                    })
+            scan_files = remaining
+            print(f"Skipping {len(existing)} scans with existing voxel grids")
+        else:
+            print("Warning: Voxel grid differs from the previous run, voxelizing all scans")
+
+    # Save the configuration before voxelizing and after each scan, so an
+    # interrupted run can be resumed with --skip-existing
+    for result in existing:
+        add_result_to_config(config, result)
+    write_config(config, config_file)
+
     # Process each scan
     print("\nVoxelizing scans...")
-    results = []
+    worker = functools.partial(
+        process_scan_position,
+        bounds=bounds,
+        voxelsize=args.voxelsize,
+        output_dir=str(output_path),
+        dtm_filename=args.dtm,
+        save_counts=not args.no_counts,
+        file_format=args.format,
+        dtype=args.dtype
+    )
 
-    for scan_info in tqdm(scan_files, desc="Processing scans"):
-        result = process_scan_position(
-            scan_info,
-            bounds,
-            args.voxelsize,
-            dtm_filename=args.dtm,
-            save_counts=not args.no_counts
-        )
+    if args.profile:
+        worker = functools.partial(batch.profile_worker, worker)
 
+    results = []
+    for result in tqdm(batch.run_scans(worker, scan_files, jobs=args.jobs),
+                       total=len(scan_files), desc="Processing scans"):
         if not result['success']:
             print(f"\nError processing {result['scan_pos']}: {result['error']}")
-            results.append(result)
-            continue
-
-        # Write voxel grids for this scan
-        vgrid = result['vgrid']
-        prefix = str(output_path / f"{result['scan_name']}")
-        vgrid.write_grids(prefix)
-
-        # Store filenames in config
-        config['positions'][result['scan_name']] = vgrid.filenames
 
         results.append(result)
+        add_result_to_config(config, result)
+        write_config(config, config_file)
+
+    # Store filenames in config in scan position order
+    results.extend(existing)
+    results.sort(key=lambda r: r['scan_pos'])
+    config['positions'] = {}
+    config.pop('scan_profiles', None)
+    for result in results:
+        add_result_to_config(config, result)
 
     # Save configuration file
-    config_file = output_path / f"{project_path.stem}_config.json"
-    with open(config_file, 'w') as f:
-        json.dump(config, indent=4, fp=f)
+    write_config(config, config_file)
 
     print(f"\nSaved configuration to {config_file}")
 
@@ -323,20 +473,29 @@ def main():
 
         try:
             vmodel = voxelization.VoxelModel(str(config_file))
-            paiv, paih, nscans = vmodel.run_linear_model(
-                min_n=args.min_n,
-                weights=args.weighted
-            )
-            cover_z = vmodel.get_cover_profile(paiv)
 
-            # Save model outputs
+            # Model outputs are written slab by slab to memory mapped files
             model_output = output_path / "model_output"
             model_output.mkdir(exist_ok=True)
 
-            np.save(model_output / "paiv.npy", paiv)
-            np.save(model_output / "paih.npy", paih)
-            np.save(model_output / "nscans.npy", nscans)
-            np.save(model_output / "cover_z.npy", cover_z)
+            sh = (vmodel.nz, vmodel.ny, vmodel.nx)
+            paiv = open_memmap(model_output / "paiv.npy", mode='w+', dtype=np.float32, shape=sh)
+            paih = open_memmap(model_output / "paih.npy", mode='w+', dtype=np.float32, shape=sh)
+            nscans = open_memmap(model_output / "nscans.npy", mode='w+', dtype=np.uint8, shape=sh)
+
+            for z0 in tqdm(range(0, vmodel.nz, args.z_chunk), desc="Running model"):
+                z1 = min(z0 + args.z_chunk, vmodel.nz)
+                paiv[z0:z1], paih[z0:z1], nscans[z0:z1] = vmodel.run_linear_model_slab(
+                    z0, args.z_chunk,
+                    min_n=args.min_n,
+                    weights=args.weighted
+                )
+
+            cover_z = open_memmap(model_output / "cover_z.npy", mode='w+', dtype=np.float32, shape=sh)
+            vmodel.get_cover_profile(paiv, out=cover_z)
+
+            for data in (paiv, paih, nscans, cover_z):
+                data.flush()
 
             print(f"Saved model outputs to {model_output}")
             print(f"  PAI vertical shape: {paiv.shape}")